@@ -19,23 +19,19 @@ tfm = tf.math
 
 
 class GibbsSampler(tf.Module):
-    def __init__(self, modelDims, modelData, priorHyperparams, rLHyperparams):
+    def __init__(self, modelDims, modelData, priorHyperparams, rLHyperparams, jit_compile=False):
 
         self.modelDims = modelDims
         self.modelData = modelData
         self.priorHyperparams = priorHyperparams
         self.rLHyperparams = rLHyperparams
+        # jit_compile=True requires all used updaters to be XLA-compilable, which excludes
+        # tf.py_function/tf.numpy_function calls, e.g. NNGP scipy-based Eta sampler or verbose progress printing.
+        # It also requires static factor counts, i.e. nfMin == nfMax for every random level,
+        # as the runtime nf adaptation of updateNf changes tensor shapes data-dependently
+        self.sampling_routine = tf.function(self.sampling_routine, reduce_retracing=True,
+                                            jit_compile=True if jit_compile else None)
 
-    @staticmethod
-    def printFunction(i, iterN, samInd):
-        outStr = "iteration " + str(i.numpy() + 1) + " / %d" % iterN
-        if samInd.numpy() >= 0:
-            outStr += " saving " + str(samInd.numpy() + 1)
-        else:
-            outStr += " transient"
-        sys.stdout.write("\r" + outStr)
-
-    @tf.function
     def sampling_routine(
         self,
         paramsInput,
@@ -47,14 +43,15 @@ class GibbsSampler(tf.Module):
         hmc_thin=10,
         flag_update_beta_eta=True,
         truncated_normal_library="tf",
+        z_compute_dtype=None,
         flag_save_eta=True,
         print_debug_flag=False,
         rng_seed=None,
         dtype=np.float64,
     ):
-        print("retracing")        
+        print("retracing")
         if rng_seed != None:
-          tf.print("random seed set to", rng_seed)
+          print("random seed set to", rng_seed)
           tf.keras.utils.set_random_seed(rng_seed)
 
         ns = self.modelDims["ns"]
@@ -69,26 +66,46 @@ class GibbsSampler(tf.Module):
         #TODO potentially move next two lines to somewhere more approriate
         # params["iD"] = tf.cast(tfm.logical_not(tfm.is_nan(self.modelData["Y"])), params["Z"].dtype) * params["sigma"]**-2
         params["Z"], params["iD"], params["poisson_omega"] = updateZ(params, self.modelData, self.rLHyperparams,
-                                                poisson_preupdate_z=False,poisson_marginalize_z=False, dtype=dtype)
+                                                poisson_preupdate_z=False,poisson_marginalize_z=False,
+                                                truncated_normal_library=truncated_normal_library,
+                                                compute_dtype=z_compute_dtype, dtype=dtype)
         if print_debug_flag:
           tf.print("Z", tf.reduce_sum(tf.cast(tfm.is_nan(params["Z"]), tf.int32)))
           tf.print("iD", tf.reduce_sum(tf.cast(tfm.is_nan(params["iD"]), tf.int32)))
 
-        mcmcSamplesBeta = tf.TensorArray(params["Beta"].dtype, size=num_samples)
-        mcmcSamplesBetaSel = [tf.TensorArray(tf.bool, size=num_samples) for i in range(ncsel)]
-        mcmcSamplesGamma = tf.TensorArray(params["Gamma"].dtype, size=num_samples)
-        mcmcSamplesiV = tf.TensorArray(params["iV"].dtype, size=num_samples)
-        mcmcSamplesRhoInd = tf.TensorArray(params["rhoInd"].dtype, size=num_samples)
-        mcmcSamplesSigma = tf.TensorArray(params["sigma"].dtype, size=num_samples)
-        mcmcSamplesLambda = [tf.TensorArray(params["Lambda"][r].dtype, size=num_samples) for r in range(nr)]
-        mcmcSamplesPsi = [tf.TensorArray(params["Psi"][r].dtype, size=num_samples) for r in range(nr)]
-        mcmcSamplesDelta = [tf.TensorArray(params["Delta"][r].dtype, size=num_samples) for r in range(nr)]
+        # with nfMin == nfMax on every level the factor counts cannot change, so updateNf is skipped
+        # and all nf-sized shapes are static; jit_compile only works in this regime
+        nfPinned = all(rLPar["nfMin"] == rLPar["nfMax"] for rLPar in self.rLHyperparams)
+
+        # statically shaped element_shape enables preallocation of the sample buffers, instead of
+        # per-write reallocation and shape inference; nf-sized dims stay dynamic due to updateNf
+        mcmcSamplesBeta = tf.TensorArray(params["Beta"].dtype, size=num_samples, element_shape=params["Beta"].shape)
+        mcmcSamplesBetaSel = [tf.TensorArray(tf.bool, size=num_samples, element_shape=par.shape) for par in params["BetaSel"]]
+        mcmcSamplesGamma = tf.TensorArray(params["Gamma"].dtype, size=num_samples, element_shape=params["Gamma"].shape)
+        mcmcSamplesiV = tf.TensorArray(params["iV"].dtype, size=num_samples, element_shape=params["iV"].shape)
+        mcmcSamplesRhoInd = tf.TensorArray(params["rhoInd"].dtype, size=num_samples, element_shape=params["rhoInd"].shape)
+        mcmcSamplesSigma = tf.TensorArray(params["sigma"].dtype, size=num_samples, element_shape=params["sigma"].shape)
+        mcmcSamplesLambda = [tf.TensorArray(params["Lambda"][r].dtype, size=num_samples,
+                                            element_shape=params["Lambda"][r].shape if nfPinned else
+                                            tf.TensorShape([None]).concatenate(params["Lambda"][r].shape[1:])) for r in range(nr)]
+        mcmcSamplesPsi = [tf.TensorArray(params["Psi"][r].dtype, size=num_samples,
+                                         element_shape=params["Psi"][r].shape if nfPinned else
+                                         tf.TensorShape([None]).concatenate(params["Psi"][r].shape[1:])) for r in range(nr)]
+        mcmcSamplesDelta = [tf.TensorArray(params["Delta"][r].dtype, size=num_samples,
+                                           element_shape=params["Delta"][r].shape if nfPinned else
+                                           tf.TensorShape([None, 1])) for r in range(nr)]
         # if flag_save_eta:
-        mcmcSamplesEta = [tf.TensorArray(params["Eta"][r].dtype, size=num_samples) for r in range(nr)]
-        mcmcSamplesAlphaInd = [tf.TensorArray(params["AlphaInd"][r].dtype, size=num_samples) for r in range(nr)]
-        mcmcSampleswRRR = tf.TensorArray(params["wRRR"].dtype if ncRRR > 0 else tf.float64, size=num_samples)
-        mcmcSamplesPsiRRR = tf.TensorArray(params["PsiRRR"].dtype if ncRRR > 0 else tf.float64, size=num_samples)
-        mcmcSamplesDeltaRRR = tf.TensorArray(params["DeltaRRR"].dtype if ncRRR > 0 else tf.float64, size=num_samples)
+        mcmcSamplesEta = [tf.TensorArray(params["Eta"][r].dtype, size=num_samples,
+                                         element_shape=params["Eta"][r].shape if nfPinned else
+                                         tf.TensorShape([npVec[r], None])) for r in range(nr)]
+        mcmcSamplesAlphaInd = [tf.TensorArray(params["AlphaInd"][r].dtype, size=num_samples,
+                                              element_shape=params["AlphaInd"][r].shape if nfPinned else None) for r in range(nr)]
+        mcmcSampleswRRR = tf.TensorArray(params["wRRR"].dtype if ncRRR > 0 else tf.float64, size=num_samples,
+                                         element_shape=params["wRRR"].shape if ncRRR > 0 else None)
+        mcmcSamplesPsiRRR = tf.TensorArray(params["PsiRRR"].dtype if ncRRR > 0 else tf.float64, size=num_samples,
+                                           element_shape=params["PsiRRR"].shape if ncRRR > 0 else None)
+        mcmcSamplesDeltaRRR = tf.TensorArray(params["DeltaRRR"].dtype if ncRRR > 0 else tf.float64, size=num_samples,
+                                             element_shape=params["DeltaRRR"].shape if ncRRR > 0 else None)
         step_num = sample_burnin + num_samples * sample_thining
         if hmc_thin > 0:
           hmc_burnin = sample_burnin // hmc_thin
@@ -98,18 +115,18 @@ class GibbsSampler(tf.Module):
           hmc_burnin = 0
           hmc_ss, hmc_las, hmc_es = [tf.constant(0, dtype)] * 3
 
-        # print(self.modelData["distr"])          
-        # print(self.modelData["Y"][:,-8:])          
+        # print(self.modelData["distr"])
+        # print(self.modelData["Y"][:,-8:])
         # print(params["Z"].numpy()[:,-8:])
-        tf.print("sampling")
+        print("sampling") # trace-time, as PrintV2 has no XLA kernel and would break jit_compile
         for n in tf.range(step_num):
             tf.autograph.experimental.set_loop_options(
                 shape_invariants=[
-                    (params["Eta"], [tf.TensorShape([npVec[r], None]) for r in range(nr)]),
-                    (params["Lambda"], [tf.TensorShape([None, ns])] * nr),
-                    (params["Psi"], [tf.TensorShape([None, ns])] * nr),
-                    (params["Delta"], [tf.TensorShape([None, 1])] * nr),
-                    (params["AlphaInd"], [tf.TensorShape(None)] * nr),
+                    (params["Eta"], [params["Eta"][r].shape if nfPinned else tf.TensorShape([npVec[r], None]) for r in range(nr)]),
+                    (params["Lambda"], [params["Lambda"][r].shape if nfPinned else tf.TensorShape([None, ns]) for r in range(nr)]),
+                    (params["Psi"], [params["Psi"][r].shape if nfPinned else tf.TensorShape([None, ns]) for r in range(nr)]),
+                    (params["Delta"], [params["Delta"][r].shape if nfPinned else tf.TensorShape([None, 1]) for r in range(nr)]),
+                    (params["AlphaInd"], [params["AlphaInd"][r].shape if nfPinned else tf.TensorShape(None) for r in range(nr)]),
                 ]
             )
             
@@ -143,7 +160,9 @@ class GibbsSampler(tf.Module):
                 params["Psi"], params["Delta"] = updateLambdaPriors(params, self.rLHyperparams, dtype=dtype)
                 params["AlphaInd"] = updateAlpha(params, self.rLHyperparams, dtype=dtype)
 
-            params["Z"], params["iD"], params["poisson_omega"] = updateZ(params, self.modelData, self.rLHyperparams, dtype=dtype)
+            params["Z"], params["iD"], params["poisson_omega"] = updateZ(params, self.modelData, self.rLHyperparams,
+                                                    truncated_normal_library=truncated_normal_library,
+                                                    compute_dtype=z_compute_dtype, dtype=dtype)
 
             if print_debug_flag:
               tf.print("Z", tf.reduce_sum(tf.cast(tfm.is_nan(params["Z"]), tf.int32)))
@@ -182,24 +201,32 @@ class GibbsSampler(tf.Module):
             
             params["Psi"], params["Delta"] = updateLambdaPriors(params, self.rLHyperparams, dtype)
             
-            params["Eta"] = updateEta(params, self.modelDims, self.modelData, self.rLHyperparams, dtype)
+            params["Eta"], LEta = updateEta(params, self.modelDims, self.modelData, self.rLHyperparams, dtype)
             if print_debug_flag:
               tf.print("Eta", [tf.reduce_sum(tf.cast(tfm.is_nan(par), tf.int32)) for par in params["Eta"]])
-            
+
             params["AlphaInd"] = updateAlpha(params, self.rLHyperparams, dtype)
-            
+
             # if z_marginalize_iter_flag == False:
-            params["sigma"] = updateSigma(params, self.modelDims, self.modelData, self.priorHyperparams, dtype)
+            # Beta, Lambda, Eta and Xeff are unchanged since updateEta, so its linear predictor is reused
+            params["sigma"] = updateSigma(params, self.modelDims, self.modelData, self.priorHyperparams, dtype, L=LEta)
             if print_debug_flag:
               tf.print("sigma", tf.reduce_sum(tf.cast(tfm.is_nan(params["sigma"]), tf.int32)))
 
-            if n < sample_burnin:
-                params["Lambda"], params["Psi"], params["Delta"], params["Eta"], params["AlphaInd"] = updateNf(params, self.rLHyperparams, n, dtype)
+            # trace-time gate: with pinned factor counts updateNf is an identity, and skipping it
+            # keeps all factor dimensions static, which jit_compile requires
+            if not nfPinned:
+                if n < sample_burnin:
+                    params["Lambda"], params["Psi"], params["Delta"], params["Eta"], params["AlphaInd"] = updateNf(params, self.rLHyperparams, n, dtype)
             # tf.print(tf.shape(params["Lambda"][0])[0])
 
             samInd = tf.cast((n - sample_burnin + 1) / sample_thining - 1, tf.int32)
-            if (n + 1) % verbose == 0:
-                tf.py_function(func=GibbsSampler.printFunction, inp=[n, step_num, samInd], Tout=[])
+            if verbose > 0: # trace-time gate, excludes progress printing from the graph when disabled
+                if (n + 1) % verbose == 0:
+                    if samInd >= 0:
+                        tf.print("\riteration", n+1, "/", step_num, "saving", samInd+1, end="", output_stream=sys.stdout)
+                    else:
+                        tf.print("\riteration", n+1, "/", step_num, "transient", end="", output_stream=sys.stdout)
                 
             if (n >= sample_burnin) & ((n - sample_burnin + 1) % sample_thining == 0):                
                 mcmcSamplesBeta = mcmcSamplesBeta.write(samInd, params["Beta"])
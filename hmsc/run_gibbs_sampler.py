@@ -48,9 +48,11 @@ def run_gibbs_sampler(
     hmc_thin=10,
     flag_update_beta_eta=True,
     truncated_normal_library="tf",
+    z_compute_dtype=None,
     flag_save_eta=True,
     flag_save_postList_to_rds=True,
     flag_profile=False,
+    flag_jit=False,
     dtype=np.float64,
 ):
     (
@@ -62,7 +64,7 @@ def run_gibbs_sampler(
         initParList,
         nChainsTotal,
     ) = load_params(init_obj_file_path, dtype)
-    gibbs = GibbsSampler(modelDims, modelData, priorHyperparams, rLHyperparams)
+    gibbs = GibbsSampler(modelDims, modelData, priorHyperparams, rLHyperparams, jit_compile=flag_jit)
     
     if chainIndList is None:
       chainIndList = [*range(nChainsTotal)]
@@ -89,6 +91,7 @@ def run_gibbs_sampler(
         hmc_thin=hmc_thin,
         flag_update_beta_eta=flag_update_beta_eta,
         truncated_normal_library=truncated_normal_library,
+        z_compute_dtype=z_compute_dtype,
         flag_save_eta=flag_save_eta,
         # rng_seed=(rng_seed+42),
         dtype=dtype,
@@ -117,6 +120,7 @@ def run_gibbs_sampler(
                 hmc_thin=hmc_thin,
                 flag_update_beta_eta=flag_update_beta_eta,
                 truncated_normal_library=truncated_normal_library,
+                z_compute_dtype=z_compute_dtype,
                 flag_save_eta=flag_save_eta,
                 # rng_seed=(rng_seed+chain),
                 dtype=dtype,
@@ -226,8 +230,8 @@ if __name__ == "__main__":
         "--tnlib",
         type=str,
         default="tf",
-        choices=["scipy", "tf", "tfd"],
-        help="which library is used for sampling trunacted normal: scipy, tf or tfd",
+        choices=["scipy", "tf", "tfd", "invcdf"],
+        help="which library is used for sampling trunacted normal: scipy, tf, tfd or invcdf",
     )
     argParser.add_argument(
         "--fse",
@@ -241,6 +245,12 @@ if __name__ == "__main__":
         default=0,
         help="whether to run profiler alongside sampling",
     )
+    argParser.add_argument(
+        "--jit",
+        type=int,
+        default=0,
+        help="whether to XLA JIT compile the sampling routine, requires all used updaters to be XLA-compilable",
+    )
     argParser.add_argument(
         "--rngseed",
         type=int,
@@ -254,6 +264,13 @@ if __name__ == "__main__":
         choices=[32, 64],
         help="which precision mode is used for sampling: fp32 or fp64",
     )
+    argParser.add_argument(
+        "--zfp",
+        type=int,
+        default=0,
+        choices=[0, 32, 64],
+        help="precision mode for the Z updater hot path: fp32 or fp64, zero follows --fp",
+    )
 
     args = argParser.parse_args()
     print("args=%s" % args)
@@ -262,6 +279,7 @@ if __name__ == "__main__":
     postList_file_path = args.output
 
     dtype = np.float32 if args.fp == 32 else np.float64
+    z_compute_dtype = {0: None, 32: np.float32, 64: np.float64}[args.zfp]
 
     run_gibbs_sampler(
         num_samples=args.samples,
@@ -276,9 +294,11 @@ if __name__ == "__main__":
         hmc_thin=args.hmcthin,
         flag_update_beta_eta=bool(args.updbe),
         truncated_normal_library=args.tnlib,
+        z_compute_dtype=z_compute_dtype,
         flag_save_eta=bool(args.fse),
         flag_save_postList_to_rds=True,
         flag_profile=bool(args.profile),
+        flag_jit=bool(args.jit),
         dtype=dtype,
     )
 
@@ -75,7 +75,7 @@ def test_updateEta(spatial_method):
 
     EtaTrue = params["Eta"]
 
-    Eta = updateEta(params, modelDims, modelData, rLHyperparams)
+    Eta, _ = updateEta(params, modelDims, modelData, rLHyperparams)
 
     for r in range(modelDims["nr"]):
         assert_allclose(Eta[r], EtaTrue[r], atol=0.1)
@@ -87,7 +87,7 @@ def test_updateEta_shape():
 
     params, modelDims, modelData, _, rLHyperparams = _simple_model()
     
-    EtaList = updateEta(params, modelDims, modelData, rLHyperparams)
+    EtaList, _ = updateEta(params, modelDims, modelData, rLHyperparams)
 
     for r in range(modelDims["nr"]):
         assert tf.shape(EtaList[r])[0] == modelDims["np"][r]
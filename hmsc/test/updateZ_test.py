@@ -4,7 +4,7 @@ import pytest
 import tensorflow as tf
 tfr, tfm = tf.random, tf.math
 
-from hmsc.updaters.updateZ import updateZ
+from hmsc.updaters.updateZ import updateZ, _truncnorm_inverse_cdf, truncated_normal_invcdf
 
 def _simple_model(spatial_method="None", dtype = np.float64):
 
@@ -73,6 +73,39 @@ def test_updateZ():
 
     assert_allclose(tf.reduce_mean(Z), tf.reduce_mean(ZTrue), atol=0.001)
 
+def test_truncnorm_inverse_cdf_extreme_loc():
+    # loc far below the lower bound: the CDF at both bounds rounds to 1 in the upper tail,
+    # so without the reflection onto the lower tail the sampler collapses to the far bound
+    from scipy.stats import truncnorm
+
+    n = 100000
+    loc, scale, low, high = -10.0, 1.0, 0.0, 1000.0
+    a = np.full([n], (low - loc) / scale)
+    b = np.full([n], (high - loc) / scale)
+
+    np.random.seed(42)
+    Z = _truncnorm_inverse_cdf(a, b, np.full([n], loc), np.full([n], scale))
+
+    assert np.all(Z >= low) and np.all(Z <= high)
+    assert_allclose(np.mean(Z), truncnorm.mean(a[0], b[0], loc=loc, scale=scale), atol=0.01)
+    assert_allclose(np.std(Z), truncnorm.std(a[0], b[0], loc=loc, scale=scale), atol=0.01)
+
+def test_truncated_normal_invcdf_extreme_loc():
+    # same extreme-offset regime as above for the in-graph inverse-CDF sampler
+    from scipy.stats import truncnorm
+
+    n = 100000
+    loc, scale, low, high = -10.0, 1.0, 0.0, 1000.0
+
+    tf.keras.utils.set_random_seed(42)
+    Z = truncated_normal_invcdf(loc=tf.fill([n, 1], tf.constant(loc, tf.float64)), scale=tf.constant(scale, tf.float64),
+                                low=tf.fill([n, 1], tf.constant(low, tf.float64)), high=tf.fill([n, 1], tf.constant(high, tf.float64))).numpy()
+
+    a, b = (low - loc) / scale, (high - loc) / scale
+    assert np.all(Z >= low) and np.all(Z <= high)
+    assert_allclose(np.mean(Z), truncnorm.mean(a, b, loc=loc, scale=scale), atol=0.01)
+    assert_allclose(np.std(Z), truncnorm.std(a, b, loc=loc, scale=scale), atol=0.01)
+
 def test_updateZ_shape():
 
     params, modelDims, modelData, _, rLHyperparams = _simple_model()
@@ -37,6 +37,8 @@ def updateBetaEta(params, modelDims, data, priorHyperparams, rLHyperparams, dtyp
   LRanLevelList = [None] * nr
   for r, (Eta, Lambda) in enumerate(zip(EtaList, LambdaList)):
     LRanLevelList[r] = tf.matmul(tf.gather(Eta, Pi[:,r]), Lambda)
+  # joint contribution of all levels, used to avoid re-summing the nr-1 other levels for each r
+  LRanTotal = tf.add_n([tf.zeros_like(Z)] + LRanLevelList)
 
   EtaListNew = [None] * nr
   for r, (Eta, Lambda, AlphaInd, rLPar) in enumerate(zip(EtaList, LambdaList, AlphaIndList, rLHyperparams)):
@@ -44,7 +46,7 @@ def updateBetaEta(params, modelDims, data, priorHyperparams, rLHyperparams, dtyp
     nf = tf.cast(tf.shape(Lambda)[-2], tf.int64)
     # if nf > 0:
     nv = npVec[r]
-    S = Z - sum([LRanLevelList[rInd] for rInd in np.setdiff1d(np.arange(nr), r)])
+    S = Z - (LRanTotal - LRanLevelList[r])
     iD_S = iD*S
     pi = Pi[:,r]
     # if rLPar["sDim"] == 0:
@@ -160,7 +162,9 @@ def updateBetaEta(params, modelDims, data, priorHyperparams, rLHyperparams, dtyp
       # tf.print(tf.reduce_max(tfm.abs(tf.concat([q1,q2], 0) - v)))
     
     EtaListNew[r] = Eta
-    LRanLevelList[r] = tf.matmul(tf.gather(Eta, Pi[:,r]), Lambda)
+    LRanLevelNew = tf.matmul(tf.gather(Eta, Pi[:,r]), Lambda)
+    LRanTotal = LRanTotal - LRanLevelList[r] + LRanLevelNew
+    LRanLevelList[r] = LRanLevelNew
     # else:
     #   EtaListNew[r] = Eta
     EtaListNew[r] = tf.ensure_shape(EtaListNew[r], [npVec[r],None])
@@ -1,7 +1,7 @@
 import numpy as np
 import tensorflow as tf
 from scipy.sparse.linalg import splu, spsolve_triangular
-from scipy.sparse import csc_matrix, csr_matrix, coo_matrix, block_diag
+from scipy.sparse import csc_matrix, csr_matrix, coo_matrix
 from hmsc.utils.tf_named_func import tf_named_func
 tfla, tfm, tfr, tfs = tf.linalg, tf.math, tf.random, tf.sparse
 
@@ -45,84 +45,119 @@ def updateEta(params, modelDims, data, rLHyperparams, dtype=np.float64):
     LRanLevelList = [None] * nr
     for r, (Eta, Lambda) in enumerate(zip(EtaList, LambdaList)):
         LRanLevelList[r] = tf.matmul(tf.gather(Eta, Pi[:,r]), Lambda)
+    # joint contribution of all levels, used to avoid re-summing the nr-1 other levels for each r
+    LRanTotal = tf.add_n([tf.zeros_like(Z)] + LRanLevelList)
+
+    # single joint draw of the Gaussian noise consumed by the per-level samplers below;
+    # GPP additionally needs nf*nK draws for the knot-level correction
+    if nr > 0:
+        noiseSizeList = [None] * nr
+        for r, (Lambda, rLPar) in enumerate(zip(LambdaList, rLHyperparams)):
+            nK = rLPar["nK"] if rLPar["sDim"] > 0 and rLPar["spatialMethod"] == "GPP" else 0
+            noiseSizeList[r] = tf.shape(Lambda)[-2] * (npVec[r] + nK)
+        noiseList = tf.split(tfr.normal([tf.add_n(noiseSizeList)], dtype=dtype), tf.stack(noiseSizeList))
+    else:
+        noiseList = []
 
     EtaListNew = [None] * nr
     for r, (Eta, Lambda, AlphaInd, rLPar) in enumerate(zip(EtaList, LambdaList, AlphaIndList, rLHyperparams)):
-        nf = tf.cast(tf.shape(Lambda)[-2], tf.int64)
+        # prefer the static factor count when available, so that the nf > 0 branch resolves at
+        # trace time and Eta keeps its static shape (required under jit_compile)
+        nf = Lambda.shape[-2] if Lambda.shape[-2] is not None else tf.cast(tf.shape(Lambda)[-2], tf.int64)
         if nf > 0:
-            S = Z - LFix - sum([LRanLevelList[rInd] for rInd in np.setdiff1d(np.arange(nr), r)])
-            mu0 = tf.scatter_nd(Pi[:,r,None], tf.matmul(iD * S, Lambda, transpose_b=True), [npVec[r],nf], name="mu0")
+            S = Z - LFix - (LRanTotal - LRanLevelList[r])
+            mu0 = tfm.unsorted_segment_sum(tf.matmul(iD * S, Lambda, transpose_b=True), Pi[:,r], npVec[r], name="mu0")
             # LamInvSigLam = tf.scatter_nd(Pi[:,r,None], tf.einsum("hj,ij,kj->ihk", Lambda, iD, Lambda), [npVec[r],nf,nf])
             #TODO bottleneck for non-spatial model
-            # Pi_iD = tf.scatter_nd(Pi[:,r,None], iD, [npVec[r],ns], name="Pi_iD")
-            piMat = tfs.SparseTensor(tf.stack([Pi[:,r], tf.range(ny,dtype=tf.int64)], axis=-1), tf.ones([ny],dtype), [npVec[r],ny])
-            Pi_iD = tfs.sparse_dense_matmul(piMat, iD, name="Pi_iD")
+            Pi_iD = tfm.unsorted_segment_sum(iD, Pi[:,r], npVec[r], name="Pi_iD")
             commonFlag = tf.reduce_all(Pi_iD == Pi_iD[0,:])
-            if commonFlag:
-              LamInvSigLam = tf.einsum("hj,j,kj->hk", Lambda, Pi_iD[0,:], Lambda, name="LamInvSigLam")
-            else:
-              LamInvSigLam = tf.einsum("hj,ij,kj->ihk", Lambda, Pi_iD, Lambda, name="LamInvSigLam")
 
+            # under XLA both branches of a cond must yield identically shaped tensors, so the
+            # rank-2 common-case LamInvSigLam stays inside its branch and the branches merge on Eta
             if rLPar["sDim"] == 0:
                 if commonFlag:
-                    EtaListNew[r] = modelNonSpatialCommon(LamInvSigLam, mu0, npVec[r], nf, dtype)
+                    LamInvSigLam = tf.einsum("hj,j,kj->hk", Lambda, Pi_iD[0,:], Lambda, name="LamInvSigLam")
+                    EtaListNew[r] = modelNonSpatialCommon(LamInvSigLam, mu0, npVec[r], nf, noiseList[r], dtype)
                 else:
-                    EtaListNew[r] = modelNonSpatial(LamInvSigLam, mu0, npVec[r], nf, dtype)
+                    LamInvSigLam = lamInvSigLamBlocks(Lambda, iD, Pi_iD, Pi[:,r], npVec[r], ny, dtype)
+                    EtaListNew[r] = modelNonSpatial(LamInvSigLam, mu0, npVec[r], nf, noiseList[r], dtype)
             else:
                 if commonFlag:
-                    LamInvSigLam = tf.tile(LamInvSigLam[None,:,:], [npVec[r],1,1])
-                    
+                    LamInvSigLam = tf.tile(tf.einsum("hj,j,kj->hk", Lambda, Pi_iD[0,:], Lambda, name="LamInvSigLam")[None,:,:], [npVec[r],1,1])
+                else:
+                    LamInvSigLam = lamInvSigLamBlocks(Lambda, iD, Pi_iD, Pi[:,r], npVec[r], ny, dtype)
+
                 if rLPar["spatialMethod"] == "Full":
-                    EtaListNew[r] = modelSpatialFull(LamInvSigLam, mu0, AlphaInd, rLPar["iWg"], npVec[r], nf, dtype)
+                    EtaListNew[r] = modelSpatialFull(LamInvSigLam, mu0, AlphaInd, rLPar["iWg"], npVec[r], nf, noiseList[r], dtype)
                 elif rLPar["spatialMethod"] == "GPP":
-                    EtaListNew[r] = modelSpatialGPP(LamInvSigLam, mu0, AlphaInd, rLPar["Fg"], rLPar["idDg"], rLPar["idDW12g"], rLPar["nK"], npVec[r], nf, dtype)
-                elif rLPar["spatialMethod"] == "NNGP":                
-                    modelSpatialNNGP_local = lambda LamInvSigLam, mu0, Alpha, nf: modelSpatialNNGP_scipy(LamInvSigLam, mu0, Alpha, rLPar["iWList_csr"], npVec[r], nf, dtype)
-                    # EtaListNew[r] = modelSpatialNNGP_local(LamInvSigLam, mu0, AlphaInd, nf)
-                    Eta = tf.numpy_function(modelSpatialNNGP_local, [LamInvSigLam, mu0, AlphaInd, nf], dtype)
+                    EtaListNew[r] = modelSpatialGPP(LamInvSigLam, mu0, AlphaInd, rLPar["Fg"], rLPar["idDg"], rLPar["idDW12g"], rLPar["nK"], npVec[r], nf, noiseList[r], dtype)
+                elif rLPar["spatialMethod"] == "NNGP":
+                    iWList = rLPar.get("iWList_coo", rLPar["iWList_csr"])
+                    modelSpatialNNGP_local = lambda LamInvSigLam, mu0, Alpha, nf, noise: modelSpatialNNGP_scipy(LamInvSigLam, mu0, Alpha, noise, iWList, npVec[r], nf, dtype)
+                    # EtaListNew[r] = modelSpatialNNGP_local(LamInvSigLam, mu0, AlphaInd, nf, noiseList[r])
+                    Eta = tf.numpy_function(modelSpatialNNGP_local, [LamInvSigLam, mu0, AlphaInd, nf, noiseList[r]], dtype)
                     EtaListNew[r] = tf.ensure_shape(Eta, [npVec[r], None])              
             
-            LRanLevelList[r] = tf.matmul(tf.gather(EtaListNew[r], Pi[:,r]), Lambda)
+            LRanLevelNew = tf.matmul(tf.gather(EtaListNew[r], Pi[:,r]), Lambda)
+            LRanTotal = LRanTotal - LRanLevelList[r] + LRanLevelNew
+            LRanLevelList[r] = LRanLevelNew
         else:
             EtaListNew[r] = Eta
         EtaListNew[r] = tf.ensure_shape(EtaListNew[r], [npVec[r],None])
 
-    return EtaListNew
+    # the updated linear predictor is returned alongside Eta, as updateSigma consumes it unchanged
+    return EtaListNew, LFix + LRanTotal
 
 
-def modelNonSpatialCommon(LamInvSigLam, mu0, np, nf, dtype=np.float64):
+def lamInvSigLamBlocks(Lambda, iD, Pi_iD, Pi_r, np, ny, dtype=np.float64):
+    # full [np,nf,nf] stack of per-plot quadratic forms
+    if tf.reduce_all(iD == iD[0,:]):
+        # iD is identical across observations (e.g. no missing data), so the per-plot quadratic
+        # form is a single [nf,nf] matrix scaled by the plot sizes
+        counts = tfm.unsorted_segment_sum(tf.ones([ny], dtype), Pi_r, np)
+        return counts[:,None,None] * tf.einsum("hj,j,kj->hk", Lambda, iD[0,:], Lambda, name="LamInvSigLamCommon")
+    else:
+        return tf.einsum("hj,ij,kj->ihk", Lambda, Pi_iD, Lambda, name="LamInvSigLam")
+
+
+def choleskySolveSample(LiV, mu0, noise):
+    # draw from N(iV^-1 mu0, iV^-1) given LiV = chol(iV); one forward and one adjoint triangular solve,
+    # shared by the non-spatial and spatial-full Eta samplers
+    mu1 = tfla.triangular_solve(LiV, mu0, name="mu1")
+    return tfla.triangular_solve(LiV, mu1 + noise, adjoint=True)
+
+
+def modelNonSpatialCommon(LamInvSigLam, mu0, np, nf, noise, dtype=np.float64):
     # tf.print("using common Eta sampler option")
     iV = tf.eye(nf, dtype=dtype) + LamInvSigLam
     LiV = tfla.cholesky(iV, name="LiV")
-    mu1 = tfla.triangular_solve(LiV, tfla.matrix_transpose(mu0), name="mu1")
-    Eta = tfla.matrix_transpose(tfla.triangular_solve(LiV, mu1 + tfr.normal([nf,np], dtype=dtype), adjoint=True))
+    Eta = tfla.matrix_transpose(choleskySolveSample(LiV, tfla.matrix_transpose(mu0), tf.reshape(noise, [nf,np])))
     return Eta
-  
 
-def modelNonSpatial(LamInvSigLam, mu0, np, nf, dtype=np.float64):
+
+def modelNonSpatial(LamInvSigLam, mu0, np, nf, noise, dtype=np.float64):
     iV = tf.eye(nf, dtype=dtype) + LamInvSigLam
     LiV = tfla.cholesky(iV, name="LiV")
     # LamInvSigLam_u, LamInvSigLam_id = tf.raw_ops.UniqueV2(x=LamInvSigLam, axis=[0])
     # iV_u = tf.eye(nf, dtype=dtype) + LamInvSigLam_u
     # LiV_u = tfla.cholesky(iV_u)
     # LiV = tf.gather(LiV_u, LamInvSigLam_id)
-    mu1 = tfla.triangular_solve(LiV, tf.expand_dims(mu0, -1), name="mu1")
-    Eta = tf.squeeze(tfla.triangular_solve(LiV, mu1 + tfr.normal([np,nf,1], dtype=dtype), adjoint=True, name="Eta"), -1)
+    Eta = tf.squeeze(choleskySolveSample(LiV, tf.expand_dims(mu0, -1), tf.reshape(noise, [np,nf,1])), -1)
     return Eta
 
 
-def modelSpatialFull(LamInvSigLam, mu0, AlphaInd, iWg, np, nf, dtype=np.float64): 
-    #TODO a lot of unnecessary tanspositions - rework if considerably affects perfomance
-    iWs = tf.reshape(tf.transpose(tfla.diag(tf.transpose(tf.gather(iWg, AlphaInd), [1,2,0])), [2,0,3,1]), [nf*np,nf*np])
-    iUEta = iWs + tf.reshape(tf.transpose(tfla.diag(tf.transpose(LamInvSigLam, [1,2,0])), [0,2,1,3]), [nf*np,nf*np])
+def modelSpatialFull(LamInvSigLam, mu0, AlphaInd, iWg, np, nf, noise, dtype=np.float64):
+    # both addends embed [h,i,k,j] blocks - per-factor iWg on the factor diagonal and per-plot
+    # LamInvSigLam on the plot diagonal - written directly with einsum instead of diag/transpose chains
+    iWs = tf.einsum("hij,hk->hikj", tf.gather(iWg, AlphaInd), tf.eye(nf, dtype=dtype), name="iWs")
+    iUEta = tf.reshape(iWs + tf.einsum("ihk,ij->hikj", LamInvSigLam, tf.eye(np, dtype=dtype)), [nf*np,nf*np])
     LiUEta = tfla.cholesky(iUEta, name="LiUEta")
-    mu1 = tfla.triangular_solve(LiUEta, tf.reshape(tf.transpose(mu0), [nf*np,1]), name="mu1")
-    eta = tfla.triangular_solve(LiUEta, mu1 + tfr.normal([nf*np,1], dtype=dtype), adjoint=True, name="eta")
+    eta = choleskySolveSample(LiUEta, tf.reshape(tf.transpose(mu0), [nf*np,1]), tf.reshape(noise, [nf*np,1]))
     Eta = tf.transpose(tf.reshape(eta, [nf,np]))
     return Eta
 
 
-def modelSpatialGPP(LamInvSigLam, mu0, AlphaInd, Fg, idDg, idDW12g, nK, nu, nf, dtype=tf.float64):
+def modelSpatialGPP(LamInvSigLam, mu0, AlphaInd, Fg, idDg, idDW12g, nK, nu, nf, noise, dtype=tf.float64):
     idDst = tf.gather(idDg, AlphaInd)
     Fst = tf.gather(Fg, AlphaInd)
     idDW12st = tf.gather(idDW12g, AlphaInd)
@@ -143,25 +178,25 @@ def modelSpatialGPP(LamInvSigLam, mu0, AlphaInd, Fg, idDg, idDW12g, nK, nu, nf,
     iA_idDW12_iH_W21idD_iA_mu0 = tf.einsum("ihg,hia,ha->ig", iAst, idDW12st, iH_W21idD_iA_mu0, name="iA_idDW12_iH_W21idD_iA_mu0")
     etaMu = iA_mu0 + iA_idDW12_iH_W21idD_iA_mu0
     
-    etaR1 = tf.squeeze(tfla.triangular_solve(LAst, tfr.normal([nu,nf,1], dtype=dtype), adjoint=True, name="etaR1"), -1)
-    tmp = tf.reshape(tfla.triangular_solve(LH, tfr.normal([nf*nK,1], dtype=dtype), adjoint=True, name="tmp"), [nf,nK])
+    etaR1 = tf.squeeze(tfla.triangular_solve(LAst, tf.reshape(noise[:nu*nf], [nu,nf,1]), adjoint=True, name="etaR1"), -1)
+    tmp = tf.reshape(tfla.triangular_solve(LH, tf.reshape(noise[nu*nf:], [nf*nK,1]), adjoint=True, name="tmp"), [nf,nK])
     etaR2 = tf.einsum("ihg,hia,ha->ig", iAst, idDW12st, tmp, name="etaR2")
     Eta = etaMu + etaR1 + etaR2
     # print(Eta)
     return tf.ensure_shape(Eta, [nu,None])
 
 
-def modelSpatialNNGP_scipy(LamInvSigLam, mu0, Alpha, iWList, nu, nf, dtype=np.float64):
-    LamInvSigLam_bdiag = block_diag([LamInvSigLam[i] for i in range(nu)], dtype=dtype)
-    dataList, colList, rowList = [None]*int(nf), [None]*int(nf), [None]*int(nf)
-    for h, a in enumerate(Alpha):
-      iW = coo_matrix(iWList[a])
-      dataList[h] = iW.data
-      colList[h] = iW.col + h*nu
-      rowList[h] = iW.row + h*nu
-    dataArray = np.concatenate(dataList)
-    colArray = np.concatenate(colList)
-    rowArray = np.concatenate(rowList)
+def modelSpatialNNGP_scipy(LamInvSigLam, mu0, Alpha, noise, iWList, nu, nf, dtype=np.float64):
+    # vectorized block-diagonal assembly of per-site [nf,nf] blocks, avoids a Python list of nu sparse matrices
+    blockInd = np.asarray(nf) * np.arange(nu)[:,None] + np.arange(nf)
+    bdiagRow = np.broadcast_to(blockInd[:,:,None], [nu,int(nf),int(nf)])
+    bdiagCol = np.broadcast_to(blockInd[:,None,:], [nu,int(nf),int(nf)])
+    LamInvSigLam_bdiag = csc_matrix((np.asarray(LamInvSigLam).ravel(),
+                                     (bdiagRow.ravel(), bdiagCol.ravel())), [nu*nf]*2, dtype=dtype)
+    iWs = [iWList[a] if isinstance(iWList[a], coo_matrix) else coo_matrix(iWList[a]) for a in np.ravel(Alpha)]
+    dataArray = np.concatenate([iW.data for iW in iWs])
+    colArray = np.concatenate([iW.col + h*nu for h, iW in enumerate(iWs)])
+    rowArray = np.concatenate([iW.row + h*nu for h, iW in enumerate(iWs)])
     iUEta = csc_matrix((dataArray,(colArray,rowArray)), [nu*nf,nu*nf]) + LamInvSigLam_bdiag
     # iWs = [kron(iWList[a], csc_matrix(coo_matrix(([1],([h],[h])), [nf,nf]))) for h, a in enumerate(Alpha)] #replaced with indices
     # iUEta = sum(iWs) + LamInvSigLam_bdiag
@@ -169,6 +204,6 @@ def modelSpatialNNGP_scipy(LamInvSigLam, mu0, Alpha, iWList, nu, nf, dtype=np.fl
     L, U = LU_factor.L, LU_factor.U
     LiUEta = csr_matrix(L.multiply(np.sqrt(U.diagonal())), dtype=dtype)
     mu1 = spsolve_triangular(LiUEta, np.reshape(mu0, [nu*nf]))
-    eta = spsolve_triangular(LiUEta.transpose(), mu1 + np.random.normal(dtype(0), dtype(1), size=[nf*nu]), lower=False)
+    eta = spsolve_triangular(LiUEta.transpose(), mu1 + np.reshape(noise, [nf*nu]), lower=False)
     Eta = np.reshape(eta, [nu,nf]).astype(dtype)
     return Eta
\ No newline at end of file
@@ -1,7 +1,9 @@
 import numpy as np
 import tensorflow as tf
+import tensorflow_probability as tfp
 from hmsc.utils.tf_named_func import tf_named_func
 tfm, tfr = tf.math, tf.random
+tfd = tfp.distributions
 
 @tf_named_func("lambdaPriors")
 def updateLambdaPriors(params, rLHyperparams, dtype=np.float64):
@@ -36,7 +38,9 @@ def updateLambdaPriors(params, rLHyperparams, dtype=np.float64):
         b2 = rLPar["b2"]
 
         ns = Lambda.shape[-1]
-        nf = tf.shape(Lambda)[0]
+        # prefer the static factor count when available, so that the nf > 0 branch resolves at
+        # trace time and the outputs keep their static shapes (required under jit_compile)
+        nf = Lambda.shape[0] if Lambda.shape[0] is not None else tf.shape(Lambda)[0]
         if nf > 0:
             aDelta = tf.concat([a1 * tf.ones([1, 1], dtype), a2 * tf.ones([nf-1, 1], dtype)], 0)
             bDelta = tf.concat([b1 * tf.ones([1, 1], dtype), b2 * tf.ones([nf-1, 1], dtype)], 0)
@@ -44,14 +48,15 @@ def updateLambdaPriors(params, rLHyperparams, dtype=np.float64):
             Tau = tfm.cumprod(Delta, 0)
             aPsi = nu/2 + 0.5
             bPsi = nu/2 + 0.5 * Lambda2 * Tau
-            PsiNew[r] = tf.squeeze(tfr.gamma([1], aPsi, bPsi, dtype=dtype), 0)
+            # tfd.Gamma instead of tfr.gamma: the latter lowers to RandomGamma, which has no XLA kernel
+            PsiNew[r] = tfd.Gamma(concentration=aPsi, rate=bPsi).sample()
             M = PsiNew[r] * Lambda2
             rowSumM = tf.reduce_sum(M, 1)
             for h in tf.range(nf):
                 Tau = tfm.cumprod(Delta, 0)
                 ad = aDelta[h, :] + 0.5 * ns * tf.cast(nf-h, dtype)
                 bd = bDelta[h, :] + 0.5 * tf.reduce_sum(Tau[h:, :] * rowSumM[h:, None], 0) / Delta[h, :]
-                Delta = tf.tensor_scatter_nd_update(Delta, [[h]], tfr.gamma([1], ad, bd, dtype=dtype))
+                Delta = tf.tensor_scatter_nd_update(Delta, [[h]], tfd.Gamma(concentration=ad, rate=bd).sample(1))
             DeltaNew[r] = Delta
             PsiNew[r] = tf.ensure_shape(PsiNew[r], [None, ns])         
         else:
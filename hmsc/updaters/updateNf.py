@@ -1,7 +1,9 @@
 import numpy as np
 import tensorflow as tf
+import tensorflow_probability as tfp
 from hmsc.utils.tf_named_func import tf_named_func
 tfm, tfr = tf.math, tf.random
+tfd = tfp.distributions
 
 @tf_named_func("nf")
 def updateNf(params, rLHyperparams, it, dtype=np.float64):
@@ -60,8 +62,10 @@ def updateNf(params, rLHyperparams, it, dtype=np.float64):
 
             if nf < nfMin or (nf < nfMax and it > 20 and numRedundant == 0 and tf.reduce_all(smallLoadingProp < 0.995)):
                 LambdaNew[r] = tf.concat([Lambda, tf.zeros([1,ns], dtype=dtype)], 0)
-                PsiNew[r] = tf.concat([Psi, tfr.gamma([1,ns], nu/2, nu/2, dtype=dtype)], 0)
-                DeltaNew[r] = tf.concat([Delta, tfr.gamma([1,1], a2, b2, dtype=dtype)], 0)
+                # tfd.Gamma instead of tfr.gamma: the latter lowers to RandomGamma, which has no XLA kernel
+                nuHalf = tf.cast(nu/2, dtype)
+                PsiNew[r] = tf.concat([Psi, tfd.Gamma(concentration=nuHalf, rate=nuHalf).sample([1,ns])], 0)
+                DeltaNew[r] = tf.concat([Delta, tfd.Gamma(concentration=tf.cast(a2, dtype), rate=tf.cast(b2, dtype)).sample([1,1])], 0)
                 EtaNew[r] = tf.concat([Eta, tfr.normal([np,1], dtype=dtype)], 1)
                 AlphaIndNew[r] = tf.concat([AlphaInd, tf.zeros([1], tf.int32)], 0)
             elif nf > nfMin and numRedundant > 0:
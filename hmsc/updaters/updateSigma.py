@@ -6,7 +6,7 @@ tfm = tf.math
 tfd = tfp.distributions
 
 @tf_named_func("sigma")
-def updateSigma(params, modelDims, data, priorHyperparameters, dtype=np.float64):
+def updateSigma(params, modelDims, data, priorHyperparameters, dtype=np.float64, L=None):
     """Update prior(s) for whole model:
     sigma - residual variance.
 
@@ -46,15 +46,15 @@ def updateSigma(params, modelDims, data, priorHyperparameters, dtype=np.float64)
     indVarSigma = tf.equal(distr[:,1], 1)
     #TODO code below contains redundant calculations for fixed variance columns
 
-    if len(X.shape.as_list()) == 2: #tf.rank(X)
-      LFix = tf.matmul(X, Beta)
-    else:
-      LFix = tf.einsum("jik,kj->ij", X, Beta)
-    LRanLevelList = [None] * nr
-    for r, (Eta, Lambda) in enumerate(zip(EtaList, LambdaList)):
-        LRanLevelList[r] = tf.matmul(tf.gather(Eta, Pi[:, r]), Lambda)
-
-    L = LFix + sum(LRanLevelList)
+    if L is None:
+      if len(X.shape.as_list()) == 2: #tf.rank(X)
+        LFix = tf.matmul(X, Beta)
+      else:
+        LFix = tf.einsum("jik,kj->ij", X, Beta)
+      LRanLevelList = [None] * nr
+      for r, (Eta, Lambda) in enumerate(zip(EtaList, LambdaList)):
+          LRanLevelList[r] = tf.matmul(tf.gather(Eta, Pi[:, r]), Lambda)
+      L = LFix + sum(LRanLevelList)
     Eps = Z - L
     
     alpha = aSigma + tf.reduce_sum(Yo, 0) / 2.0
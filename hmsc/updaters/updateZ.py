@@ -1,7 +1,9 @@
 import numpy as np
 import tensorflow as tf
 from hmsc.utils.tf_named_func import tf_named_func
-tfm, tfr = tf.math, tf.random
+tfla, tfm, tfr = tf.linalg, tf.math, tf.random
+
+INFTY = 1e+3 # sentinel bound for unconstrained probit cells
 
 
 @tf_named_func("truncated_normal_tfd")
@@ -19,33 +21,79 @@ def truncated_normal_tf(loc, scale, low, high):
     ny, ns = loc.shape
     dtype = loc.dtype
     if ns == 0:
-        samTN = tf.convert_to_tensor((), dtype=dtype)
-    else:
-        samTN = parameterized_truncated_normal(
-            shape=[ny*ns], means=tf.reshape(loc,[ny*ns]), stddevs=tf.tile(scale,[ny]),
-            minvals=tf.reshape(low,[ny*ns]), maxvals=tf.reshape(high,[ny*ns]), dtype=dtype)
-    Z = tf.reshape(samTN, [ny,ns])
+        return tf.zeros([ny,0], dtype)
+    loc = tf.reshape(loc, [ny*ns])
+    scale = tf.reshape(tf.broadcast_to(scale,[ny,ns]), [ny*ns])
+    low, high = tf.reshape(low, [ny*ns]), tf.reshape(high, [ny*ns])
+    # unconstrained cells (missing data, both bounds at the sentinels) take a plain normal
+    # draw; only genuinely bounded cells pay for the rejection sampling in
+    # parameterized_truncated_normal
+    free = tfm.logical_and(low <= -INFTY, high >= INFTY)
+    indFree, indTN = tf.where(free)[:,0], tf.where(tfm.logical_not(free))[:,0]
+    samFree = tf.gather(loc, indFree) + tf.gather(scale, indFree) * tfr.normal(tf.shape(indFree), dtype=dtype)
+    samTN = parameterized_truncated_normal(
+        shape=tf.shape(indTN), means=tf.gather(loc, indTN), stddevs=tf.gather(scale, indTN),
+        minvals=tf.gather(low, indTN), maxvals=tf.gather(high, indTN), dtype=dtype)
+    Z = tf.scatter_nd(indFree[:,None], samFree, [ny*ns]) + tf.scatter_nd(indTN[:,None], samTN, [ny*ns])
+    return tf.reshape(Z, [ny,ns])
+
+
+@tf_named_func("truncated_normal_invcdf")
+def truncated_normal_invcdf(loc, scale, low, high):
+    # branch-free in-graph inverse-transform sampler; unlike the rejection-based
+    # parameterized_truncated_normal, its cost does not depend on the bound configuration
+    dtype = loc.dtype
+    a = (low - loc) / scale
+    b = (high - loc) / scale
+    # cells entirely in the upper tail are reflected onto the lower tail, where erfc keeps
+    # precision down to ~1e-308 instead of rounding to 1 roughly 8 sigma past the bound
+    reflect = a > 0
+    aR = tf.where(reflect, -b, a)
+    bR = tf.where(reflect, -a, b)
+    sqrt05 = tf.constant(0.5**0.5, dtype)
+    pa = 0.5 * tfm.erfc(-aR * sqrt05)
+    pb = 0.5 * tfm.erfc(-bR * sqrt05)
+    u = tfr.uniform(tf.shape(loc), dtype=dtype)
+    x = tfm.ndtri(pa + u * (pb - pa))
+    x = tf.where(reflect, -x, x)
+    # ndtri returns +-inf in the (now extremely remote) case that the mass still underflows
+    Z = loc + scale * tf.clip_by_value(x, a, b)
     return Z
 
 
+def _truncnorm_inverse_cdf(a, b, loc, scale):
+    # vectorized inverse-transform sampler; avoids the per-row argument checking
+    # overhead of scipy.stats.truncnorm.rvs on ny*ns-sized calls
+    from scipy.special import ndtr, ndtri
+    # cells entirely in the upper tail are reflected onto the lower tail, where ndtr keeps
+    # precision down to ~1e-308 instead of rounding to 1 roughly 8 sigma past the bound
+    reflect = a > 0
+    aR = np.where(reflect, -b, a)
+    bR = np.where(reflect, -a, b)
+    pa, pb = ndtr(aR), ndtr(bR)
+    u = np.random.uniform(size=a.shape)
+    x = ndtri(pa + u * (pb - pa))
+    x = np.where(reflect, -x, x)
+    # ndtri returns +-inf in the (now extremely remote) case that the mass still underflows
+    return (loc + scale * np.clip(x, a, b)).astype(a.dtype)
+
+
 @tf_named_func("truncated_normal_scipy")
 def truncated_normal_scipy(loc, scale, low, high):
-    from scipy.stats import truncnorm
-
     ny, ns = loc.shape
     dtype = loc.dtype
     loc = tf.reshape(loc, [ny*ns])
-    scale = tf.tile(scale, [ny])
+    scale = tf.reshape(tf.broadcast_to(scale, [ny,ns]), [ny*ns])
     a = (tf.reshape(low, [ny*ns]) - loc) / scale
     b = (tf.reshape(high,[ny*ns]) - loc) / scale
-    Z = tf.reshape(tf.numpy_function(truncnorm.rvs, [a, b, loc, scale], dtype), [ny,ns])
+    Z = tf.reshape(tf.numpy_function(_truncnorm_inverse_cdf, [a, b, loc, scale], dtype), [ny,ns])
     return Z
 
 
 @tf_named_func("z")
 def updateZ(params, data, rLHyperparams, *,
             poisson_preupdate_z=False, poisson_marginalize_z=False,
-            truncated_normal_library="tf", dtype=tf.float64):
+            truncated_normal_library="tf", compute_dtype=None, dtype=tf.float64):
     """Update conditional updater(s)
     Z - latent variable.
 
@@ -73,33 +121,52 @@ def updateZ(params, data, rLHyperparams, *,
     Pi = data["Pi"]
     distr = data["distr"]
 
+    # optional reduced-precision hot path: the dense linear predictor and the data
+    # augmentation run in compute_dtype, while Z/iD are returned in dtype as before
+    if compute_dtype is None:
+        compute_dtype = dtype
+    if compute_dtype != dtype:
+        Beta = tf.cast(Beta, compute_dtype)
+        EtaList = [tf.cast(Eta, compute_dtype) for Eta in EtaList]
+        LambdaList = [tf.cast(Lambda, compute_dtype) for Lambda in LambdaList]
+        sigma = tf.cast(sigma, compute_dtype)
+        X = tf.cast(X, compute_dtype)
+        Y = tf.cast(Y, compute_dtype)
+        if ZPrev is not None:
+            ZPrev = tf.cast(ZPrev, compute_dtype)
+
     if len(X.shape.as_list()) == 2: #tf.rank(X) X.ndim == 2:
         LFix = tf.matmul(X, Beta)
     else:
-        LFix = tf.einsum("jik,kj->ij", X, Beta)
+        # jik,kj->ij as a batched matvec, hitting the GEMV path instead of einsum's generic planner
+        LFix = tf.transpose(tfla.matvec(X, tf.transpose(Beta)))
 
     LRanList = []
     for r, (Eta, Lambda, rLPar) in enumerate(zip(EtaList, LambdaList, rLHyperparams)):
         xMat = rLPar.get("xMat")
+        if xMat is not None and xMat.dtype != compute_dtype:
+            xMat = tf.cast(xMat, compute_dtype)
         if xMat is None:
             LRan = tf.matmul(Eta, Lambda)
         else:
-            LRan = tf.einsum("ih,ik,hjk->ij", Eta, xMat, Lambda)
+            # ih,ik,hjk->ij split into a GEMM over h and a batched matvec over k
+            LRan = tfla.matvec(tf.tensordot(Eta, Lambda, [[1],[0]]), xMat)
         LRanList.append(tf.gather(LRan, Pi[:,r]))
-    L = tf.add_n([LFix] + LRanList)
+    L = tf.add_n([LFix] + LRanList) if LRanList else LFix
     if ZPrev is None:
         ZPrev = L
 
-    Yo = tfm.logical_not(tfm.is_nan(Y))
+    Yo = tf.convert_to_tensor(data["Yo"]) if "Yo" in data else tfm.logical_not(tfm.is_nan(Y))
     indColNormal = np.where(distr[:,0] == 1)[0]
     indColProbit = np.where(distr[:,0] == 2)[0]
     indColPoisson = np.where(distr[:,0] == 3)[0]
-    empty = tf.zeros([Y.shape[0], 0], dtype)
+    empty = tf.zeros([Y.shape[0], 0], compute_dtype)
+    iSigma2 = tfm.reciprocal(sigma*sigma)
 
     if indColNormal.shape[0] > 0:
         ZNormal, iDNormal = calculate_z_normal(
-                *gather(Y, Yo, L, sigma, indices=indColNormal),
-                dtype=dtype)
+                *gather(Y, Yo, L, sigma, iSigma2, indices=indColNormal),
+                dtype=compute_dtype)
     else:
         ZNormal = empty
         iDNormal = empty
@@ -111,32 +178,49 @@ def updateZ(params, data, rLHyperparams, *,
             truncated_normal = truncated_normal_tf
         elif truncated_normal_library == 'scipy':
             truncated_normal = truncated_normal_scipy
+        elif truncated_normal_library == 'invcdf':
+            truncated_normal = truncated_normal_invcdf
 
         ZProbit, iDProbit = calculate_z_probit(
-                *gather(Y, Yo, L, sigma, indices=indColProbit),
+                *gather(Y, Yo, L, sigma, iSigma2, indices=indColProbit),
                 truncated_normal=truncated_normal,
-                dtype=dtype)
+                dtype=compute_dtype)
     else:
         ZProbit = empty
         iDProbit = empty
 
     if indColPoisson.shape[0] > 0:
+        omega = params.get("poisson_omega")
+        if omega is not None and compute_dtype != dtype:
+            omega = tf.cast(omega, compute_dtype)
         ZPoisson, iDPoisson, poisson_omega = calculate_z_poisson(
-                *gather(Y, Yo, L, sigma, ZPrev, indices=indColPoisson),
-                omega=params.get("poisson_omega"),
+                *gather(Y, Yo, L, sigma, iSigma2, ZPrev, indices=indColPoisson),
+                omega=omega,
                 preupdate_z=poisson_preupdate_z,
                 marginalize_z=poisson_marginalize_z,
-                dtype=dtype)
+                dtype=compute_dtype)
     else:
         ZPoisson = empty
         iDPoisson = empty
         poisson_omega = empty
 
-    ZStack = tf.concat([ZNormal, ZProbit, ZPoisson], -1)
-    iDStack = tf.concat([iDNormal, iDProbit, iDPoisson], -1)
-    indColStack = tf.concat([indColNormal, indColProbit, indColPoisson], 0)
-    ZNew = tf.gather(ZStack, tf.argsort(indColStack), axis=-1)
-    iDNew = tf.gather(iDStack, tf.argsort(indColStack), axis=-1)
+    # empty families are dropped at trace time, so zero-width blocks never enter the concat
+    indColList = [indColNormal, indColProbit, indColPoisson]
+    ZList, iDList = [ZNormal, ZProbit, ZPoisson], [iDNormal, iDProbit, iDPoisson]
+    nonEmpty = [k for k in range(3) if indColList[k].shape[0] > 0]
+    if len(nonEmpty) == 1:
+        # single observation model: the block already holds all columns in original order
+        ZNew, iDNew = ZList[nonEmpty[0]], iDList[nonEmpty[0]]
+    else:
+        ZStack = tf.concat([ZList[k] for k in nonEmpty], -1)
+        iDStack = tf.concat([iDList[k] for k in nonEmpty], -1)
+        # distr is fixed indexing metadata, so the inverse permutation is a trace-time constant
+        perm = np.argsort(np.concatenate([indColList[k] for k in nonEmpty]))
+        ZNew = tf.gather(ZStack, perm, axis=-1)
+        iDNew = tf.gather(iDStack, perm, axis=-1)
+    if compute_dtype != dtype:
+        ZNew, iDNew = tf.cast(ZNew, dtype), tf.cast(iDNew, dtype)
+        poisson_omega = tf.cast(poisson_omega, dtype)
     return ZNew, iDNew, poisson_omega
 
 
@@ -144,67 +228,74 @@ def gather(*args, indices):
     return (tf.gather(a, indices, axis=-1) for a in args)
 
 
-def calculate_z_normal(Y, Yo, L, sigma, *, dtype):
+def calculate_z_normal(Y, Yo, L, sigma, iSigma2, *, dtype):
     # no data augmentation for normal model in columns with continious unbounded data
     Z = tf.where(Yo, Y, L + sigma * tfr.normal(Y.shape, dtype=dtype))
-    iD = tf.cast(Yo, dtype) * sigma**-2
+    iD = tf.cast(Yo, dtype) * iSigma2
     return Z, iD
 
 
-def calculate_z_probit(Y, Yo, L, sigma, *, truncated_normal, dtype):
+def calculate_z_probit(Y, Yo, L, sigma, iSigma2, *, truncated_normal, dtype):
     # Albert and Chib (1993) data augemntation for probit model in columns with binary data
-    INFTY = 1e+3
     Ym = tfm.logical_not(Yo)
-    low = tf.where(tfm.logical_or(Y == 0, Ym), tf.cast(-INFTY, dtype), tf.zeros_like(Y))
-    high = tf.where(tfm.logical_or(Y == 1, Ym), tf.cast(INFTY, dtype), tf.zeros_like(Y))
+    # code cells as 0/1 for observed y=0/1 and 2 for missing, then gather both bounds in one pass
+    code = tf.cast(tf.where(Yo, Y, tf.zeros_like(Y)), tf.int32) + 2*tf.cast(Ym, tf.int32)
+    bounds = tf.constant([[-INFTY, 0.], [0., INFTY], [-INFTY, INFTY]], dtype)
+    low, high = tf.unstack(tf.gather(bounds, code), axis=-1)
     Z = truncated_normal(loc=L, scale=sigma, low=low, high=high)
-    iD = tf.cast(Yo, dtype) * sigma**-2
+    iD = tf.cast(Yo, dtype) * iSigma2
     return Z, iD
 
 
-def calculate_z_poisson(Y, Yo, L, sigma, Z, *,
+def calculate_z_poisson(Y, Yo, L, sigma, iSigma2, Z, *,
                         omega,
                         preupdate_z, marginalize_z, dtype):
     r = tf.constant(1000., dtype=dtype) #Neg-binomial approximation constant
 
     if preupdate_z:
-        Z = sample_z(Y, L, sigma, omega, r, dtype=dtype)
+        Z = sample_z(Y, L, iSigma2, omega, r, dtype=dtype)
 
-    omega = draw_polya_gamma(Y + r, Z - tfm.log(r), dtype=dtype)
+    omega = draw_polya_gamma(Y, Z, r, dtype=dtype)
     if marginalize_z:
         # marginalize Z for equivalent effect on BetaLambda or Eta. Cannot be used for conjuately updating sigma.
         Z = (Y-r)/(2.*omega) + tfm.log(r)
-        iD = tf.cast(Yo, dtype) * (sigma**2. * tf.ones_like(L) + omega**-1)**-1
+        iD = tf.cast(Yo, dtype) * tfm.reciprocal(sigma**2. + tfm.reciprocal(omega))
     else:
         # sample Z. Required for conjuately updating sigma.
-        Z = sample_z(Y, L, sigma, omega, r, dtype=dtype)
-        iD = tf.cast(Yo, dtype) * sigma**-2.
+        Z = sample_z(Y, L, iSigma2, omega, r, dtype=dtype)
+        iD = tf.cast(Yo, dtype) * iSigma2
     
     # masking missing data to avoid nan usage in other updaters
     Z = tf.where(Yo, Z, tf.zeros_like(Z))
     return Z, iD, omega
 
 
-def sample_z(Y, L, sigma, omega, r, dtype):
-    sigmaZ2 = (sigma**-2. * tf.ones_like(L) + omega)**-1.
-    mu = sigmaZ2*((Y-r)/2. + omega*tfm.log(r) + sigma**-2. * L)
+def sample_z(Y, L, iSigma2, omega, r, dtype):
+    sigmaZ2 = tfm.reciprocal(iSigma2 + omega)
+    mu = sigmaZ2*((Y-r)/2. + omega*tfm.log(r) + iSigma2 * L)
     Z = tfr.normal(Y.shape, mu, tf.sqrt(sigmaZ2), dtype=dtype)
     return Z
 
 
-def draw_polya_gamma(h, z, dtype):
+def draw_polya_gamma(Y, Z, r, dtype):
   # with h > 50 normal approx is used, so we reimplement only that alternative
   # pg_h = tf.reshape(h, [-1])
   # pg_z = tf.reshape(z, [-1]) # sign does not matter
   # draw_pg = lambda h,z: random_polyagamma(h, z, disable_checks=True)
   # omega = tf.reshape(tf.numpy_function(draw_pg, [pg_h, pg_z], dtype), h.shape)
-  m0 = 0.25 * h
-  s0 = tf.sqrt(h / 24.)
+  # h/z built inline so the elementwise chain fuses into one pass over Y and Z
+  h = Y + r
+  z = Z - tfm.log(r)
+  # guard the z->0 limit with Taylor expansions of the even ratios tanh(z/2)/z and
+  # (sinh(z)-z)/z^3, instead of computing the singular expressions and patching with z==0
   x1 = tfm.tanh(0.5 * z)
-  m1 = 0.5 * h * x1 / z
-  s1 = tf.sqrt(0.25 * h * (tfm.sinh(z) - z) * (1. - x1**2) / z**3)
-  m = tf.where(z == 0, m0, m1)
-  s = tf.where(z == 0, s0, s1)
+  zsq = z * z
+  small = tfm.abs(z) < 1e-4
+  zSafe = tf.where(small, tf.ones_like(z), z)
+  mRatio = tf.where(small, 0.5 - zsq/24., x1 / zSafe)
+  s2Ratio = tf.where(small, 1./6. + zsq/120., (tfm.sinh(zSafe) - zSafe) / (zsq*zSafe))
+  m = 0.5 * h * mRatio
+  s = tf.sqrt(0.25 * h * (1. - x1*x1) * s2Ratio)
   # formula in package does not have tf.abs, I added it here to ensure positiveness
   omega = tf.abs(m + s*tfr.normal(h.shape, dtype=dtype))
   return omega
@@ -1,7 +1,9 @@
 import numpy as np
 import tensorflow as tf
+import tensorflow_probability as tfp
 from hmsc.utils.tf_named_func import tf_named_func
 tfla, tfm, tfr = tf.linalg, tf.math, tf.random
+tfd = tfp.distributions
 
 @tf_named_func("RRRPriors")
 def updatewRRRPriors(params, modelDims, priorHyperparams, dtype=tf.float64):
@@ -22,7 +24,8 @@ def updatewRRRPriors(params, modelDims, priorHyperparams, dtype=tf.float64):
     Lambda2 = Lambda**2
     aPsi = nu/2 + 0.5
     bPsi = nu/2 + 0.5*Lambda2 * Tau[:,None]
-    Psi = tf.squeeze(tfr.gamma([1], aPsi, bPsi, dtype=dtype), 0)
+    # tfd.Gamma instead of tfr.gamma: the latter lowers to RandomGamma, which has no XLA kernel
+    Psi = tfd.Gamma(concentration=aPsi, rate=bPsi).sample()
 
     M = Psi * Lambda2
     rowSumM = tf.reduce_sum(M, -1)
@@ -30,6 +33,6 @@ def updatewRRRPriors(params, modelDims, priorHyperparams, dtype=tf.float64):
         Tau = tfm.cumprod(Delta)
         ad = aVec[h] + 0.5 * ns * (nf-h)
         bd = bVec[h] + 0.5 * tf.reduce_sum(Tau[h:] * rowSumM[h:]) / Delta[h]
-        Delta = tf.tensor_scatter_nd_update(Delta, [[h]], tfr.gamma([1], ad, bd, dtype=dtype))
+        Delta = tf.tensor_scatter_nd_update(Delta, [[h]], tfd.Gamma(concentration=ad, rate=bd).sample([1]))
 
     return Psi, Delta
\ No newline at end of file
@@ -1,7 +1,9 @@
 import ujson as json
+import orjson
 import pandas as pd
 import pyreadr
 import os
+from concurrent.futures import ProcessPoolExecutor
 
 
 def load_model_from_json(json_file_path):
@@ -16,116 +18,89 @@ def load_model_from_rds(rds_file_path):
 
     long_str = pyreadr.read_r(rds_file_path)
     hmsc_obj = json.loads(long_str[None][None][0])
-    
+
     return hmsc_obj, hmsc_obj.get("hM")
 
 
+def sample_to_jsonable(params):
+    # keeps tensors as ndarrays - orjson serializes them directly with
+    # OPT_SERIALIZE_NUMPY, avoiding the per-element Python objects of tolist()
+    sample_data = {}
+
+    sample_data["Beta"] = params["Beta"].numpy()
+    sample_data["BetaSel"] = [par.numpy() for par in params["BetaSel"]]
+    sample_data["Gamma"] = params["Gamma"].numpy()
+    sample_data["iV"] = params["iV"].numpy()
+    sample_data["rhoInd"] = (params["rhoInd"]+1).numpy()
+    sample_data["sigma"] = params["sigma"].numpy()
+
+    sample_data["Lambda"] = [par.numpy() for par in params["Lambda"]]
+    sample_data["Psi"] = [par.numpy() for par in params["Psi"]]
+    sample_data["Delta"] = [par.numpy() for par in params["Delta"]]
+    sample_data["Eta"] = [par.numpy() for par in params["Eta"]]
+    sample_data["Alpha"] = [(par+1).numpy() for par in params["AlphaInd"]]
+
+    if params["wRRR"] is not None:
+      sample_data["wRRR"] = params["wRRR"].numpy()
+      sample_data["PsiRRR"] = params["PsiRRR"].numpy()
+      sample_data["DeltaRRR"] = params["DeltaRRR"].numpy()
+    else:
+      sample_data["wRRR"] = sample_data["PsiRRR"] = sample_data["DeltaRRR"] = None
+
+    return sample_data
+
+
 def save_postList_to_json(postList, postList_file_path, chain):
 
     print("Start dumping.")
 
-    json_data = {}
-
-    for i in range(len(postList)):
-        sample_data = {}
-        params = postList[i]
-        
-        sample_data["Beta"] = params["Beta"].numpy().tolist()
-        sample_data["BetaSel"] = [par.numpy().tolist() for par in params["BetaSel"]]
-        sample_data["Gamma"] = params["Gamma"].numpy().tolist()
-        sample_data["iV"] = params["iV"].numpy().tolist()
-        sample_data["rhoInd"] = (params["rhoInd"]+1).numpy().tolist()
-        sample_data["sigma"] = params["sigma"].numpy().tolist()
-        
-        sample_data["Lambda"] = [par.numpy().tolist() for par in params["Lambda"]]
-        sample_data["Psi"] = [par.numpy().tolist() for par in params["Psi"]]
-        sample_data["Delta"] = [par.numpy().tolist() for par in params["Delta"]]
-        sample_data["Eta"] = [par.numpy().tolist() for par in params["Eta"]]
-        sample_data["Alpha"] = [(par+1).numpy().tolist() for par in params["AlphaInd"]]
-        
-        if params["wRRR"] is not None:
-          sample_data["wRRR"] = params["wRRR"].numpy().tolist()
-          sample_data["PsiRRR"] = params["PsiRRR"].numpy().tolist()
-          sample_data["DeltaRRR"] = params["DeltaRRR"].numpy().tolist()
-        else:
-          sample_data["wRRR"] = sample_data["PsiRRR"] = sample_data["DeltaRRR"] = None
-
-        json_data[i] = sample_data
-
     postList_file_path = (
         os.path.splitext(postList_file_path)[0] + "_" + str(chain+1) + ".json"
     )
     print("Dumping, chain %d" % chain)
-    with open(postList_file_path, "w") as fp:
-        json.dump(json_data, fp)
+    # samples are converted and written one at a time, so peak memory stays at
+    # one sample's payload instead of the whole chain
+    with open(postList_file_path, "wb") as fp:
+        fp.write(b"{")
+        for i in range(len(postList)):
+            if i > 0:
+                fp.write(b",")
+            fp.write(b'"%d":' % i)
+            fp.write(orjson.dumps(sample_to_jsonable(postList[i]), option=orjson.OPT_SERIALIZE_NUMPY))
+        fp.write(b"}")
+
+
+def _dump_chain(chain_data):
+    return orjson.dumps(chain_data, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS)
 
 
 def save_chains_postList_to_json(postList, postList_file_path, nChains):
 
-    json_data = {chain: {} for chain in range(nChains)}
-
-    for chain in range(nChains):
-        for i in range(len(postList[chain])):
-            sample_data = {}
-            params = postList[chain][i]
-
-            sample_data["Beta"] = params["Beta"].numpy().tolist()
-            sample_data["BetaSel"] = [par.numpy().tolist() for par in params["BetaSel"]]
-            sample_data["Gamma"] = params["Gamma"].numpy().tolist()
-            sample_data["iV"] = params["iV"].numpy().tolist()
-            sample_data["rhoInd"] = (params["rhoInd"]+1).numpy().tolist()
-            sample_data["sigma"] = params["sigma"].numpy().tolist()
-            
-            sample_data["Lambda"] = [par.numpy().tolist() for par in params["Lambda"]]
-            sample_data["Psi"] = [par.numpy().tolist() for par in params["Psi"]]
-            sample_data["Delta"] = [par.numpy().tolist() for par in params["Delta"]]
-            sample_data["Eta"] = [par.numpy().tolist() for par in params["Eta"]] 
-            sample_data["Alpha"] = [(par+1).numpy().tolist() for par in params["AlphaInd"]]
-            
-            if params["wRRR"] is not None:
-              sample_data["wRRR"] = params["wRRR"].numpy().tolist()
-              sample_data["PsiRRR"] = params["PsiRRR"].numpy().tolist()
-              sample_data["DeltaRRR"] = params["DeltaRRR"].numpy().tolist()
-            else:
-              sample_data["wRRR"] = sample_data["PsiRRR"] = sample_data["DeltaRRR"] = None
-
-            json_data[chain][i] = sample_data
-
-    with open(postList_file_path, "w") as fp:
-        json.dump(json_data, fp)
+    # tensors are converted to ndarrays in the parent (TF objects do not pickle),
+    # then each chain is encoded in its own worker and stitched into a single file
+    chainDataList = [{i: sample_to_jsonable(postList[chain][i]) for i in range(len(postList[chain]))}
+                     for chain in range(nChains)]
+    if nChains > 1:
+        with ProcessPoolExecutor(max_workers=min(nChains, os.cpu_count())) as executor:
+            chainBytesList = list(executor.map(_dump_chain, chainDataList))
+    else:
+        chainBytesList = [_dump_chain(chainData) for chainData in chainDataList]
+
+    with open(postList_file_path, "wb") as fp:
+        fp.write(b"{")
+        for chain, chainBytes in enumerate(chainBytesList):
+            if chain > 0:
+                fp.write(b",")
+            fp.write(b'"%d":' % chain)
+            fp.write(chainBytes)
+        fp.write(b"}")
 
 
 def save_chains_postList_to_rds(postList, postList_file_path, nChains):
 
-    json_data = {chain: {} for chain in range(nChains)}
-
-    for chain in range(nChains):
-        for i in range(len(postList[chain])):
-            sample_data = {}
-            params = postList[chain][i]
-
-            sample_data["Beta"] = params["Beta"].numpy().tolist()
-            sample_data["BetaSel"] = [par.numpy().tolist() for par in params["BetaSel"]]
-            sample_data["Gamma"] = params["Gamma"].numpy().tolist()
-            sample_data["iV"] = params["iV"].numpy().tolist()
-            sample_data["rhoInd"] = (params["rhoInd"]+1).numpy().tolist()
-            sample_data["sigma"] = params["sigma"].numpy().tolist()
-            
-            sample_data["Lambda"] = [par.numpy().tolist() for par in params["Lambda"]]
-            sample_data["Psi"] = [par.numpy().tolist() for par in params["Psi"]]
-            sample_data["Delta"] = [par.numpy().tolist() for par in params["Delta"]]
-            sample_data["Eta"] = [par.numpy().tolist() for par in params["Eta"]] 
-            sample_data["Alpha"] = [(par+1).numpy().tolist() for par in params["AlphaInd"]]
-            
-            if params["wRRR"] is not None:
-              sample_data["wRRR"] = params["wRRR"].numpy().tolist()
-              sample_data["PsiRRR"] = params["PsiRRR"].numpy().tolist()
-              sample_data["DeltaRRR"] = params["DeltaRRR"].numpy().tolist()
-            else:
-              sample_data["wRRR"] = sample_data["PsiRRR"] = sample_data["DeltaRRR"] = None
-
-            json_data[chain][i] = sample_data
-
-    json_str = json.dumps(json_data)
-    
-    pyreadr.write_rds(postList_file_path, pd.DataFrame([[json_str]]), compress="gzip")
\ No newline at end of file
+    json_data = {chain: {i: sample_to_jsonable(postList[chain][i]) for i in range(len(postList[chain]))}
+                 for chain in range(nChains)}
+
+    json_str = orjson.dumps(json_data, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS).decode()
+
+    pyreadr.write_rds(postList_file_path, pd.DataFrame([[json_str]]), compress="gzip")
@@ -21,6 +21,7 @@ def load_model_data(hmscModel, importedInitParList, dtype=np.float64):
 
     modelData = {}
     modelData["Y"] = Y
+    modelData["Yo"] = np.logical_not(np.isnan(Y)) # fixed observation mask, precomputed once
     modelData["X"] = X
     modelData["T"] = T
     if C_import is None or len(C_import) == 0:
@@ -192,6 +193,8 @@ def load_random_level_hyperparams(hmscModel, dataParList, dtype=np.float64):
                     detW[ag] = np.sum(np.log(D))
                     
                 rLPar["iWList_csr"] = iWList_csr
+                # precomputed COO views, so the per-iteration NNGP Eta sampler avoids format conversions
+                rLPar["iWList_coo"] = [sparse.coo_matrix(iW) for iW in iWList_csr]
                 rLPar["RiWList"] = RiWList
                 rLPar["detWg"] = detW
         
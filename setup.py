@@ -8,6 +8,7 @@ setup(
     packages=find_packages(include=['hmsc', 'hmsc.*']),
     install_requires=[
         'numpy',
+        'orjson',
         'pandas',
         'pyreadr',
         'scipy',